@@ -0,0 +1,156 @@
+"""
+# Concussion / adapters
+
+Adapters for parsing structured command output (JSON lines, CSV and
+whitespace-separated tables) into Python objects.
+
+All adapters are generators that consume lines lazily, so they can be used to
+process arbitrarily large amounts of output in constant memory.
+"""
+from itertools import chain
+from typing import Any, Iterable, Iterator, Optional, Sequence
+import csv
+import json
+
+
+def parse_jsonl(
+    lines: Iterable[str],
+    fields: Optional[Sequence[str]] = None,
+) -> Iterator[Any]:
+    """
+    Parse each non-empty line as a JSON value.
+
+    If `fields` is given, each object is projected down to only those keys
+    (with `None` for missing keys), so that the rest of each object can be
+    freed immediately. Values other than objects can't be projected, so a
+    `TypeError` is raised for them.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        value = json.loads(line)
+        if fields is None:
+            yield value
+        elif isinstance(value, dict):
+            yield {f: value.get(f) for f in fields}
+        else:
+            raise TypeError(
+                f"Can't select fields from {type(value).__name__} value "
+                f"{line.strip()!r}, expected a JSON object"
+            )
+
+
+def _project(
+    names: list[str],
+    fields: Optional[Sequence[str]],
+) -> list[tuple[str, int]]:
+    """
+    Find the index of each of the given fields within the header names
+    """
+    if fields is None:
+        return list(zip(names, range(len(names))))
+    projection = []
+    for f in fields:
+        try:
+            projection.append((f, names.index(f)))
+        except ValueError:
+            raise KeyError(f"No column named {f!r}") from None
+    return projection
+
+
+def _rows_as_records(
+    rows: Iterator[list[str]],
+    fields: Optional[Sequence[str]],
+) -> Iterator[dict[str, Optional[str]]]:
+    """
+    Use the first row as a header, and yield the remaining rows as dicts
+    """
+    names = next(rows, None)
+    if names is None:
+        return
+    projection = _project(names, fields)
+    for row in rows:
+        yield {
+            name: row[i] if i < len(row) else None
+            for name, i in projection
+        }
+
+
+def _rows_as_lists(
+    rows: Iterator[list[str]],
+    fields: Optional[Sequence[int]],
+) -> Iterator[list[Optional[str]]]:
+    """
+    Yield rows as lists, projected down to the given column indexes (with
+    `None` for columns that a row doesn't have)
+    """
+    if fields is None:
+        yield from rows
+        return
+    for row in rows:
+        yield [row[i] if -len(row) <= i < len(row) else None for i in fields]
+
+
+def parse_csv(
+    lines: Iterable[str],
+    fields: Optional[Sequence[Any]] = None,
+    header: bool = True,
+    delimiter: str = ",",
+) -> Iterator[Any]:
+    """
+    Parse lines as CSV.
+
+    If `header` is set, the first row gives the column names, and each
+    remaining row is yielded as a dict, otherwise rows are yielded as lists.
+    `fields` selects a subset of columns, as names if there is a header, or
+    as indexes otherwise. Rows that are missing a selected column have `None`
+    for it.
+    """
+    rows = csv.reader(lines, delimiter=delimiter)
+    if header:
+        yield from _rows_as_records(rows, fields)
+    else:
+        yield from _rows_as_lists(rows, fields)
+
+
+def parse_columns(
+    lines: Iterable[str],
+    fields: Optional[Sequence[Any]] = None,
+    header: bool = True,
+    maxsplit: Optional[int] = None,
+) -> Iterator[Any]:
+    """
+    Parse lines as a whitespace-separated table, such as the output of `ps`.
+
+    If `header` is set, the first row gives the column names, and each
+    remaining row is yielded as a dict, otherwise rows are yielded as lists.
+    `fields` selects a subset of columns, as names if there is a header, or
+    as indexes otherwise.
+
+    Output without a header row, such as from `ls -l`, needs `header=False`,
+    otherwise its first row is used as the column names. Note that `ls -l`
+    starts with a `total` line, which is yielded as a row of its own (with
+    `None` for the columns it doesn't have).
+
+    `maxsplit` limits the number of times each row is split, so that the last
+    column can contain spaces (eg the command in `ps` output). If there is a
+    header, this defaults to splitting each row into at most as many columns
+    as the header has.
+    """
+    if header:
+        lines = iter(lines)
+        first = next(lines, None)
+        if first is None:
+            return
+        names = first.split()
+        split = len(names) - 1 if maxsplit is None else maxsplit
+        rows = (
+            line.rstrip().split(None, split) for line in lines if line.strip()
+        )
+        yield from _rows_as_records(chain([names], rows), fields)
+    else:
+        split = -1 if maxsplit is None else maxsplit
+        rows = (
+            line.rstrip().split(None, split) for line in lines if line.strip()
+        )
+        yield from _rows_as_lists(rows, fields)
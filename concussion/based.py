@@ -4,46 +4,15 @@
 Base class for Concussion commands
 """
 from abc import abstractmethod
-from io import StringIO
-from typing import Optional, TextIO, cast
-import subprocess
-import sys
+from typing import Any, Iterator, Optional, Sequence, TextIO
 import os
-from threading import current_thread
+import shutil
 
+from concussion import adapters
+from concussion.environment import Environment, shell_env
 from concussion.cursed_path import CursedPath, CursedPathJoinable
-from concussion.stoppable_thread import StoppableThread
-
-
-def threaded_write_out(buf: TextIO, output_to: TextIO) -> StoppableThread:
-    """
-    Write output from buffer to the given output in a separate thread, so that
-    we can do other work elsewhere.
-
-    I wish there was a nicer way to do this. I mean there probably is but idk
-    what it is
-    """
-    def do_write():
-        t = cast(StoppableThread, current_thread())
-        # print(f"Thread buffer start: {buf} -> {output_to}")
-        # Infinite loop until the buffer is closed, then we stop
-        try:
-            while not t.stopped():
-                # Read buffer line-by-line. I can't think of a cleaner solution
-                output_to.write(buf.readline())
-            # Read the last of the buffer
-            output_to.write(buf.read())
-        except ValueError:
-            # Close the output buffer
-            output_to.close()
-            # print(f"Thread buffer end: {buf} -> {output_to}")
-
-    # The threads don't seem to be dying properly, so let's at least make sure
-    # they don't prevent us from exiting
-    t = StoppableThread(target=do_write, daemon=True)
-    t.start()
-
-    return t
+from concussion.plan import ExecutionPlan, PlannedCommand
+from concussion.watch import watch as watch_command
 
 
 class ConcussionBase:
@@ -82,7 +51,11 @@ class ConcussionBase:
         File to read input from
         """
 
-        self._stderr_thread: Optional[StoppableThread] = None
+        self._env: Optional[Environment] = None
+        """
+        Environment overrides for the command, or `None` to use the shell's
+        environment
+        """
 
     def _clone(self) -> 'ConcussionBase':
         """
@@ -94,7 +67,7 @@ class ConcussionBase:
         new._out_file = self._out_file
         new._out_append = self._out_append
         new._in_file = self._in_file
-        new._stderr_thread = None
+        new._env = self._env
         return new
 
     def __str__(self) -> str:
@@ -112,113 +85,158 @@ class ConcussionBase:
 
     def debug(self) -> str:
         """
-        Debug representation
-        """
-        out = []
-        out.append(f"command: {self._args}")
-        if self._in_file:
-            out.append(f" -> input file: {self._in_file}")
-        if self._out_file:
-            out.append(
-                f" -> input file: {self._out_file} "
-                f"{'(appending)' if self._out_append else ''}"
-            )
-        # Evaluating this as a bool executes the command, so we need to
-        # explicitly check for None
-        if self._pipe_from is not None:
-            out.append(" -> input piped from other command:")
-            out.append(self._pipe_from.debug())
-
-        return "\n".join(out)
+        Debug representation, describing how the command will be executed
+        """
+        return self.prepare().explain()
 
-    def run(self, debug: bool = False) -> int:
+    def prepare(self) -> ExecutionPlan:
         """
-        Run the command and return its exit code
+        Compile the command into an execution plan, which can be run many
+        times without needing to process the command again.
         """
-        if debug:
-            print(f"!!! Executing {self.debug()}")
         if len(self._args) == 0:
-            return 0
-
-        if self._in_file:
-            overall_input: TextIO = open(str(self._in_file), 'r')
-        else:
-            overall_input = sys.stdin
-
-        stdout, stderr = self.exec(overall_input)
-
-        t_stderr = threaded_write_out(stderr, sys.stderr)
-
-        if self._out_file:
-            t_stdout = threaded_write_out(
-                stdout,
-                # Handle logic for appending
-                open(str(self._out_file), 'a' if self._out_append else 'w')
-            )
-        else:
-            t_stdout = threaded_write_out(stdout, sys.stdout)
-
-        return_code = self.finish_exec()
-
-        # Set environment variable with return code
-        os.environ["?"] = str(return_code)
-
-        # Kill all our threads
-        t_stderr.stop()
-        t_stdout.stop()
-
-        return return_code
-
-    def exec(
-        self,
-        stdin: TextIO,
-        debug: bool = False,
-    ) -> tuple[TextIO, TextIO]:
-        # Evaluating this as a bool executes the command, so we need to
-        # explicitly check for None
-        if self._pipe_from is not None:
-            if debug:
-                print(
-                    f"!!! {self._args[0]} receives pipe from "
-                    f"{self._pipe_from._args[0]}"
-                )
-            stdout, stderr = self._pipe_from.exec(stdin)
-            our_input = stdout
-            self._stderr_thread = threaded_write_out(stderr, sys.stderr)
-        else:
-            if debug:
-                print(f"!!! {self._args[0]} receives stdin")
-            our_input = stdin
-
-        return self.do_exec(our_input)
+            return ExecutionPlan(())
+        commands = []
+        cmd: Optional[ConcussionBase] = self
+        while cmd is not None:
+            commands.append(cmd.do_prepare())
+            cmd = cmd._pipe_from
+        return ExecutionPlan(tuple(reversed(commands)))
+
+    def _planned(self, **kwargs: Any) -> PlannedCommand:
+        """
+        Create a planned command for this command, with its arguments,
+        environment and redirects.
+        """
+        return PlannedCommand(
+            argv=tuple(str(a) for a in self._args),
+            env=self._env,
+            in_file=None if self._in_file is None else str(self._in_file),
+            out_file=None if self._out_file is None else str(self._out_file),
+            out_append=self._out_append,
+            **kwargs,
+        )
 
     @abstractmethod
-    def do_exec(self, stdin: TextIO) -> tuple[TextIO, TextIO]:
+    def do_prepare(self) -> PlannedCommand:
         """
-        Execute this command. Must be implemented in subclasses.
+        Create the planned command for this command. Must be implemented in
+        subclasses.
         """
         raise NotImplementedError()
 
-    def finish_exec(self) -> int:
+    def run(self, debug: bool = False) -> int:
+        """
+        Run the command and return its exit code
         """
-        Finish execution of command and return result
+        if debug:
+            print(f"!!! Executing {self.debug()}")
+        return self.prepare().run()
 
-        This part handles calling the function in programs we piped from
+    def _iter_stdout(self) -> Iterator[str]:
+        """
+        Run the command, yielding lines of its output as they arrive rather
+        than writing them to stdout. If the generator is closed before the
+        command finishes, the command is killed.
         """
-        if self._pipe_from is not None:
-            self._pipe_from.finish_exec()
-        if self._stderr_thread:
-            self._stderr_thread.stop()
-        return self.do_finish_exec()
+        execution = self.prepare().start(capture=True)
+        if execution.stdout is None:
+            execution.wait()
+            return
 
-    @abstractmethod
-    def do_finish_exec(self) -> int:
+        finished = False
+        try:
+            yield from execution.stdout
+            finished = True
+        finally:
+            if not finished:
+                execution.kill()
+            execution.wait()
+
+    def iter_lines(self) -> Iterator[str]:
         """
-        Finish execution of command and return result
+        Run the command, yielding each line of its output as it arrives,
+        without the trailing newline.
+        """
+        for line in self._iter_stdout():
+            yield line.removesuffix("\n")
 
-        This part should be overridden by child classes to actually wait for
-        the execution to finish.
+    def iter_jsonl(
+        self,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Iterator[Any]:
         """
+        Run the command, parsing each line of its output as JSON as it
+        arrives. If `fields` is given, objects only include those keys.
+        """
+        return adapters.parse_jsonl(self._iter_stdout(), fields)
+
+    def iter_csv(
+        self,
+        fields: Optional[Sequence[Any]] = None,
+        header: bool = True,
+        delimiter: str = ",",
+    ) -> Iterator[Any]:
+        """
+        Run the command, parsing its output as CSV as it arrives. If `header`
+        is set, rows are dicts keyed by column names, otherwise they are
+        lists. `fields` selects a subset of columns.
+        """
+        return adapters.parse_csv(
+            self._iter_stdout(),
+            fields,
+            header,
+            delimiter,
+        )
+
+    def iter_columns(
+        self,
+        fields: Optional[Sequence[Any]] = None,
+        header: bool = True,
+        maxsplit: Optional[int] = None,
+    ) -> Iterator[Any]:
+        """
+        Run the command, parsing its output as a whitespace-separated table
+        (eg from `ps`) as it arrives. If `header` is set, rows are dicts keyed
+        by column names, otherwise they are lists. `fields` selects a subset
+        of columns. Output without a header row, such as from `ls -l`, needs
+        `header=False`.
+        """
+        return adapters.parse_columns(
+            self._iter_stdout(),
+            fields,
+            header,
+            maxsplit,
+        )
+
+    def watch(
+        self,
+        paths: 'CursedPathJoinable | ConcussionBase | list',
+        interval: float = 0.5,
+        debounce: float = 0.1,
+        poll: bool = False,
+    ) -> int:
+        """
+        Run the command, then re-run it whenever any of the given files or
+        directories change, until interrupted with Ctrl+C.
+
+        * `paths`: paths to watch. Directories are watched recursively.
+        * `interval`: seconds between checks when polling for changes.
+        * `debounce`: seconds to wait for changes to settle before re-running.
+        * `poll`: always poll for changes, even if inotify is available.
+        """
+        if isinstance(paths, ConcussionBase):
+            watch_paths = [str(a) for a in paths._args]
+        elif isinstance(paths, (list, tuple)):
+            watch_paths = []
+            for p in paths:
+                if isinstance(p, ConcussionBase):
+                    watch_paths.extend(str(a) for a in p._args)
+                else:
+                    watch_paths.append(str(CursedPath(p)))
+        else:
+            watch_paths = [str(CursedPath(paths))]
+        return watch_command(self, watch_paths, interval, debounce, poll)
 
     def __add__(self, other: object) -> 'ConcussionBase':
         """
@@ -243,6 +261,22 @@ class ConcussionBase:
             # printing them instead of executing the command.
             raise TypeError("Expected a str or something")
 
+    def __radd__(self, other: object) -> 'ConcussionBase':
+        """
+        Run the command with environment overrides, eg
+        `shenv(FOO="bar") + printenv`
+        """
+        if isinstance(other, Environment):
+            new_cmd = self._clone()
+            if self._env is None:
+                new_cmd._env = other
+            else:
+                # Our own overrides take priority
+                new_cmd._env = Environment(other, self._env.overrides)
+            return new_cmd
+        else:
+            return NotImplemented
+
     def __getattr__(self, name: str) -> 'ConcussionBase':
         new_cmd = self._clone()
         new_cmd._args[-1] = getattr(new_cmd._args[-1], name)
@@ -371,22 +405,26 @@ class ConcussionBuiltin(ConcussionBase):
     def __init__(self) -> None:
         super().__init__()
         self._args.append(CursedPath(self.__class__.__name__))
-        self._exit_code = 0
 
     @abstractmethod
     def run_builtin(self, stdin: TextIO) -> tuple[str, str]:
         """Run the command"""
 
-    def do_exec(self, stdin: TextIO) -> tuple[TextIO, TextIO]:
+    def exec_builtin(self, stdin: TextIO) -> tuple[str, str, int]:
+        """
+        Run the builtin, reporting any errors it raises on stderr.
+
+        Returns its stdout, stderr and exit code. Nothing is stored on the
+        builtin, so the same builtin can safely be run many times at once.
+        """
         try:
             out, err = self.run_builtin(stdin)
-            return StringIO(out), StringIO(err)
+            return out, err, 0
         except Exception as e:
-            self._exit_code = 1
-            return StringIO(), StringIO(str(e) + "\n")
+            return "", str(e) + "\n", 1
 
-    def do_finish_exec(self) -> int:
-        return self._exit_code
+    def do_prepare(self) -> PlannedCommand:
+        return self._planned(builtin=self._clone())
 
 
 class ConcussionExecutable(ConcussionBase):
@@ -394,30 +432,12 @@ class ConcussionExecutable(ConcussionBase):
         super().__init__()
         if executable is not None:
             self._args.append(CursedPath(executable))
-        self._process: Optional[subprocess.Popen] = None
 
-    def do_exec(self, stdin: TextIO) -> tuple[TextIO, TextIO]:
-        try:
-            self._process = subprocess.Popen(
-                [str(a) for a in self._args],
-                stdin=stdin,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-        except FileNotFoundError:
-            return (
-                StringIO(),
-                StringIO(f"{self._args[0]}: command not found\n")
-            )
-
-        assert self._process.stdout is not None
-        assert self._process.stderr is not None
-
-        # The inheritance for buffers in python is so confusing
-        return self._process.stdout, self._process.stderr  # type: ignore
-
-    def do_finish_exec(self) -> int:
-        if self._process is None:
-            return 1
-        return self._process.wait()
+    def do_prepare(self) -> PlannedCommand:
+        name = str(self._args[0])
+        if os.sep in name:
+            executable: Optional[str] = name
+        else:
+            env = shell_env if self._env is None else self._env
+            executable = shutil.which(name, path=env.get("PATH"))
+        return self._planned(executable=executable)
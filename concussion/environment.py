@@ -0,0 +1,157 @@
+"""
+# Concussion / environment
+
+Environment variables passed to commands.
+
+The shell's environment is the process environment (`os.environ`). Commands
+can be given extra variables using copy-on-write overlays, which only build a
+full environment block when they are first used, and then reuse it until
+something underneath them changes.
+"""
+from typing import Iterator, Mapping, MutableMapping, Optional
+import os
+
+
+class Environment(MutableMapping[str, str]):
+    """
+    An environment, which is either the shell's environment (if it has no
+    parent), or an overlay of overrides on top of a parent environment.
+
+    An override of `None` removes a variable from the overlay.
+    """
+
+    def __init__(
+        self,
+        parent: Optional['Environment'] = None,
+        overrides: Optional[Mapping[str, Optional[str]]] = None,
+    ) -> None:
+        self._parent = parent
+        """
+        Environment that this overlays, or `None` for the shell environment
+        """
+
+        self._overrides: dict[str, Optional[str]] = dict(overrides or {})
+        """
+        Variables overridden by this overlay
+        """
+
+        self._version = 0
+        """
+        Incremented whenever this environment is modified, so that overlays
+        know when to rebuild their environment block
+        """
+
+        self._block: Optional[dict[str, str]] = None
+        self._block_key: tuple[int, ...] = ()
+
+        self._environ: Mapping = {}
+        """
+        Copy of `os.environ` when it was last checked, so that the shell
+        environment can tell if it has been modified directly
+        """
+
+        self.status = 0
+        """
+        Exit code of the most recently run command (`$?` in other shells)
+        """
+
+    def __repr__(self) -> str:
+        if self._parent is None:
+            return "Environment()"
+        args = ", ".join(f"{k}={v!r}" for k, v in self.overrides.items())
+        return f"Environment({args})"
+
+    def _key(self) -> tuple[int, ...]:
+        """
+        Versions of this environment and all its parents
+        """
+        if self._parent is None:
+            # `os.environ` can be modified directly, so check whether it has
+            # changed. Comparing its underlying dict is much quicker than
+            # going through its mapping interface.
+            environ = getattr(os.environ, "_data", os.environ)
+            if environ != self._environ:
+                self._environ = dict(environ)
+                self._version += 1
+            return (self._version,)
+        return self._parent._key() + (self._version,)
+
+    @property
+    def overrides(self) -> dict[str, Optional[str]]:
+        """
+        All overrides applied on top of the shell environment by this overlay
+        and its parents.
+        """
+        if self._parent is None:
+            return {}
+        return self._parent.overrides | self._overrides
+
+    def overlay(self, **overrides: Optional[str]) -> 'Environment':
+        """
+        Create an overlay of this environment with the given overrides
+        """
+        return Environment(self, overrides)
+
+    def block(self) -> Optional[dict[str, str]]:
+        """
+        Environment block to pass to a child process, or `None` if the child
+        should simply inherit the shell's environment.
+
+        The block is cached, and only rebuilt if this environment or any of its
+        parents are modified, including if `os.environ` is modified directly.
+        """
+        if self._parent is None:
+            return None
+        key = self._key()
+        if self._block is None or key != self._block_key:
+            block = self._parent.block()
+            block = dict(os.environ) if block is None else dict(block)
+            for k, v in self._overrides.items():
+                if v is None:
+                    block.pop(k, None)
+                else:
+                    block[k] = v
+            self._block = block
+            self._block_key = key
+        return self._block
+
+    def __getitem__(self, key: str) -> str:
+        if self._parent is None:
+            return os.environ[key]
+        if key in self._overrides:
+            value = self._overrides[key]
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self._parent[key]
+
+    def __setitem__(self, key: str, value: str) -> None:
+        if self._parent is None:
+            os.environ[key] = value
+        else:
+            self._overrides[key] = value
+        self._version += 1
+
+    def __delitem__(self, key: str) -> None:
+        if self._parent is None:
+            del os.environ[key]
+        else:
+            # Make sure it exists so we raise a KeyError if it doesn't
+            self[key]
+            self._overrides[key] = None
+        self._version += 1
+
+    def __iter__(self) -> Iterator[str]:
+        block = self.block()
+        return iter(os.environ if block is None else block)
+
+    def __len__(self) -> int:
+        block = self.block()
+        return len(os.environ if block is None else block)
+
+
+shell_env = Environment()
+"""
+Environment of the shell. Modifying it modifies the environment of this
+process, which is inherited by all commands.
+"""
@@ -0,0 +1,369 @@
+"""
+# Concussion / history
+
+Persistent command history for the shell.
+
+History is stored as an append-only log of framed records, so that multiple
+shell sessions can safely append to the same file at the same time. Each record
+is a short header (a magic number, the length of the payload and its CRC32)
+followed by the UTF-8 encoded command.
+
+Loading is kept cheap by memory-mapping the file and only building the search
+index the first time it is actually needed.
+"""
+from bisect import bisect_right
+from typing import Iterator, Optional
+import mmap
+import os
+import struct
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows doesn't have fcntl
+    fcntl = None  # type: ignore
+
+
+RECORD_MAGIC = b"\xc0\x5e"
+"""
+Magic number at the start of every history record
+"""
+
+RECORD_HEADER = struct.Struct("<2sII")
+"""
+Header of a history record: the magic number, the length of the payload and
+the CRC32 of the payload
+"""
+
+SEPARATOR = "\0"
+"""
+Separator used between entries in the substring search corpus
+"""
+
+
+def default_history_path() -> str:
+    """
+    Path to the history file, which can be overridden using the
+    `CONCUSSION_HISTORY` environment variable.
+    """
+    path = os.environ.get("CONCUSSION_HISTORY")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".concussion_history")
+
+
+class History:
+    """
+    Command history, backed by an append-only log file.
+
+    Entries are written to the file as soon as they are added, but calls to
+    `fsync` are batched, since syncing after every command would make the
+    shell feel sluggish on slow disks.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        sync_every: int = 32,
+        sync_interval: float = 5.0,
+    ) -> None:
+        self.path = default_history_path() if path is None else path
+        """
+        Path to the history file
+        """
+
+        self.sync_every = sync_every
+        """
+        Maximum number of records to write before calling `fsync`
+        """
+
+        self.sync_interval = sync_interval
+        """
+        Maximum number of seconds to wait between calls to `fsync`
+        """
+
+        self._entries: Optional[list[str]] = None
+        """
+        History entries, oldest first. Loaded on first access.
+        """
+
+        self._offset = 0
+        """
+        Offset in the history file that we have loaded records up to
+        """
+
+        self._fd: Optional[int] = None
+        """
+        File descriptor used to append to the history file
+        """
+
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        self._corpus: Optional[str] = None
+        """
+        All entries joined by `SEPARATOR`, used for substring search
+        """
+
+        self._starts: list[int] = []
+        """
+        Offset of each entry within the substring search corpus
+        """
+
+    def _lock(self, fd: int, exclusive: bool) -> None:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def _unlock(self, fd: int) -> None:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _parse(self, data: bytes | mmap.mmap, start: int) -> int:
+        """
+        Parse records from the given data, starting at the given offset,
+        returning the offset that parsing stopped at.
+
+        Garbage between records (eg from a session that crashed mid-write) is
+        skipped by searching for the next magic number. Each record's checksum
+        is verified, so that the length of a torn record can't swallow the
+        records written after it.
+        """
+        assert self._entries is not None
+        pos = start
+        end = len(data)
+        header = RECORD_HEADER.size
+        while pos + header <= end:
+            magic, length, crc = RECORD_HEADER.unpack_from(data, pos)
+            if magic == RECORD_MAGIC and pos + header + length <= end:
+                payload = data[pos + header:pos + header + length]
+                if zlib.crc32(payload) == crc:
+                    self._add_entry(payload.decode("utf-8", errors="replace"))
+                    pos += header + length
+                    continue
+            # Corrupt or incomplete record, so try to resync
+            next_pos = data.find(RECORD_MAGIC, pos + 1)
+            if next_pos == -1:
+                break
+            pos = next_pos
+        return pos
+
+    def reload(self) -> None:
+        """
+        Load any records that have been appended to the history file since it
+        was last read, including those written by other sessions.
+        """
+        if self._entries is None:
+            self._entries = []
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            self._lock(fd, exclusive=False)
+            try:
+                size = os.fstat(fd).st_size
+                if size <= self._offset:
+                    return
+                with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as data:
+                    self._offset = self._parse(data, self._offset)
+            finally:
+                self._unlock(fd)
+        finally:
+            os.close(fd)
+
+    @property
+    def entries(self) -> list[str]:
+        """
+        History entries, oldest first
+        """
+        if self._entries is None:
+            self.reload()
+        assert self._entries is not None
+        return self._entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def tail(self, count: int) -> list[str]:
+        """
+        Return the most recent `count` entries, oldest first.
+
+        If the history hasn't been loaded yet, only the end of the file is
+        parsed, so that this stays fast no matter how long the history is.
+        """
+        if count <= 0:
+            return []
+        if self._entries is not None:
+            return self._entries[-count:]
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return []
+        try:
+            self._lock(fd, exclusive=False)
+            try:
+                size = os.fstat(fd).st_size
+                if size == 0:
+                    return []
+                with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as data:
+                    return self._parse_tail(data, count)
+            finally:
+                self._unlock(fd)
+        finally:
+            os.close(fd)
+
+    def _parse_tail(self, data: bytes | mmap.mmap, count: int) -> list[str]:
+        """
+        Parse up to `count` records from the end of the given data, by
+        searching backwards for magic numbers, returning them oldest first.
+        """
+        entries: list[str] = []
+        header = RECORD_HEADER.size
+        # Start of the earliest record found so far
+        pos = len(data)
+        search_end = pos
+        while len(entries) < count:
+            start = data.rfind(RECORD_MAGIC, 0, search_end)
+            if start == -1:
+                break
+            # Magic numbers could overlap, so keep searching from just after
+            # this one
+            search_end = start + len(RECORD_MAGIC) - 1
+            if start + header > pos:
+                continue
+            magic, length, crc = RECORD_HEADER.unpack_from(data, start)
+            record_end = start + header + length
+            if record_end > pos:
+                continue
+            payload = data[start + header:record_end]
+            if zlib.crc32(payload) == crc:
+                entries.append(payload.decode("utf-8", errors="replace"))
+                pos = start
+        entries.reverse()
+        return entries
+
+    def _add_entry(self, entry: str) -> None:
+        """
+        Add an entry to the in-memory history
+        """
+        assert self._entries is not None
+        self._entries.append(entry)
+        # Rebuilding the corpus is cheap enough that it's not worth keeping it
+        # up to date incrementally
+        self._corpus = None
+
+    def append(self, entry: str) -> None:
+        """
+        Add an entry to the history, and append it to the history file.
+        """
+        if not entry.strip():
+            return
+        payload = entry.encode("utf-8")
+        record = RECORD_HEADER.pack(
+            RECORD_MAGIC,
+            len(payload),
+            zlib.crc32(payload),
+        ) + payload
+
+        if self._fd is None:
+            self._fd = os.open(
+                self.path,
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                0o600,
+            )
+        self._lock(self._fd, exclusive=True)
+        try:
+            os.write(self._fd, record)
+            self._unsynced += 1
+            if (
+                self._unsynced >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval
+            ):
+                self.sync()
+        finally:
+            self._unlock(self._fd)
+
+        # Pick up our own record, as well as any from other sessions that were
+        # written since we last checked. If the history hasn't been loaded
+        # yet, this happens when it is first needed instead.
+        if self._entries is not None:
+            self.reload()
+
+    def sync(self) -> None:
+        """
+        Flush all written records to disk
+        """
+        if self._fd is not None and self._unsynced:
+            os.fsync(self._fd)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Sync and close the history file
+        """
+        if self._fd is not None:
+            self.sync()
+            os.close(self._fd)
+            self._fd = None
+
+    def _build_corpus(self) -> str:
+        if self._corpus is None:
+            self._starts = []
+            pos = 0
+            for entry in self.entries:
+                self._starts.append(pos)
+                pos += len(entry) + len(SEPARATOR)
+            self._corpus = SEPARATOR.join(self.entries)
+        return self._corpus
+
+    def _matches(self, substring: str) -> Iterator[int]:
+        """
+        Yield the index of each entry containing the given substring, most
+        recent first.
+        """
+        if SEPARATOR in substring or not self.entries:
+            return
+        corpus = self._build_corpus()
+        end = len(corpus)
+        while True:
+            pos = corpus.rfind(substring, 0, end)
+            if pos == -1:
+                return
+            i = bisect_right(self._starts, pos) - 1
+            yield i
+            if i == 0:
+                return
+            # Skip any other matches in this entry
+            end = self._starts[i] - len(SEPARATOR)
+
+    def find(self, substring: str) -> list[int]:
+        """
+        Return the index of every entry containing the given substring,
+        oldest first.
+        """
+        return list(reversed(list(self._matches(substring))))
+
+    def search(
+        self,
+        substring: str,
+        limit: Optional[int] = None,
+    ) -> list[str]:
+        """
+        Return unique entries containing the given substring, most recently
+        used first.
+        """
+        entries = self.entries
+        seen: set[str] = set()
+        matches: list[str] = []
+        for i in self._matches(substring):
+            if limit is not None and len(matches) >= limit:
+                break
+            if entries[i] not in seen:
+                seen.add(entries[i])
+                matches.append(entries[i])
+        return matches
@@ -0,0 +1,269 @@
+"""
+# Concussion / output
+
+Forwarding command output to its destination
+"""
+from collections import deque
+from typing import TextIO, cast
+from threading import Event, current_thread
+import codecs
+import io
+import os
+import select
+import sys
+import time
+
+from concussion.stoppable_thread import StoppableThread
+
+
+FRAME_INTERVAL = 1 / 30
+"""
+Seconds between each flush of output to the terminal
+"""
+
+CHUNK_SIZE = 64 * 1024
+"""
+Maximum number of bytes to read from a command's output at once
+"""
+
+FRAME_SIZE = 256 * 1024
+"""
+Maximum number of characters to buffer before flushing output to the terminal
+without waiting for the end of the frame
+"""
+
+FLOOD_RATE = 1024 * 1024
+"""
+Number of bytes per second of output, above which the output is considered to
+be flooding the terminal
+"""
+
+FLOOD_SECONDS = 1.0
+"""
+Number of seconds that output must flood the terminal for before we stop
+displaying it, and that it must slow down for before we display it again
+"""
+
+RING_LINES = 500
+"""
+Number of lines to display once the output slows down or the command finishes
+if its output flooded the terminal
+"""
+
+OUTPUT_DRAIN_TIMEOUT = 1.0
+"""
+Maximum number of seconds to wait for output to finish being displayed once a
+command exits
+"""
+
+EXIT_INTERRUPTED = 130
+"""
+Exit code used for commands interrupted using Ctrl+C (128 + SIGINT)
+"""
+
+
+class OutputThread(StoppableThread):
+    """
+    Thread that forwards output, which can be stopped (meaning that it should
+    finish forwarding the remaining output), or aborted (meaning that it
+    should discard it).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._abort_event = Event()
+
+    def abort(self):
+        self._abort_event.set()
+        self.stop()
+
+    def aborted(self):
+        return self._abort_event.is_set()
+
+
+def threaded_write_out(buf: TextIO, output_to: TextIO) -> OutputThread:
+    """
+    Write output from buffer to the given output in a separate thread, so that
+    we can do other work elsewhere.
+
+    I wish there was a nicer way to do this. I mean there probably is but idk
+    what it is
+    """
+    def do_write():
+        t = cast(OutputThread, current_thread())
+        # print(f"Thread buffer start: {buf} -> {output_to}")
+        # Infinite loop until the buffer is closed, then we stop
+        try:
+            while not t.stopped():
+                # Read buffer line-by-line. I can't think of a cleaner solution
+                output_to.write(buf.readline())
+            # Read the last of the buffer
+            if not t.aborted():
+                output_to.write(buf.read())
+        except ValueError:
+            # Close the output buffer
+            output_to.close()
+            # print(f"Thread buffer end: {buf} -> {output_to}")
+
+    # The threads don't seem to be dying properly, so let's at least make sure
+    # they don't prevent us from exiting
+    t = OutputThread(target=do_write, daemon=True)
+    t.start()
+
+    return t
+
+
+def terminal_write_out(
+    buf: TextIO,
+    output_to: TextIO,
+    ring_lines: int = RING_LINES,
+) -> OutputThread:
+    """
+    Write output from buffer to a terminal in a separate thread.
+
+    Output is read in large chunks and written at most once per frame, rather
+    than line-by-line. If the output floods the terminal for a sustained
+    period, we stop displaying it, and only keep the last `ring_lines` lines,
+    which are displayed once the output slows down or the command finishes.
+    """
+    def do_write():
+        t = cast(OutputThread, current_thread())
+        fd = buf.fileno()
+        decoder = codecs.getincrementaldecoder(
+            getattr(buf, "encoding", None) or "utf-8"
+        )(errors="replace")
+
+        pending: list[str] = []
+        pending_size = 0
+        last_flush = time.monotonic()
+        window_start = last_flush
+        window_bytes = 0
+
+        flooding = False
+        ring: deque[str] = deque(maxlen=ring_lines)
+        partial = ""
+        hidden = 0
+
+        def flush():
+            nonlocal pending_size
+            text = "".join(pending)
+            pending.clear()
+            pending_size = 0
+            # Write in chunks, so that we can stop quickly if aborted
+            for i in range(0, len(text), CHUNK_SIZE):
+                if t.aborted():
+                    return
+                output_to.write(text[i:i + CHUNK_SIZE])
+                output_to.flush()
+
+        def show_hidden():
+            nonlocal partial, hidden
+            hidden -= len(ring)
+            output_to.write(f"[concussion: {hidden} lines hidden]\n")
+            output_to.write("".join(line + "\n" for line in ring) + partial)
+            output_to.flush()
+            ring.clear()
+            partial = ""
+            hidden = 0
+
+        while not t.aborted():
+            ready = True
+            if flooding:
+                # Check whether the flood is over at the end of the window,
+                # even if no more output arrives
+                timeout = max(
+                    window_start + FLOOD_SECONDS - time.monotonic(),
+                    FRAME_INTERVAL,
+                )
+                ready = bool(select.select([fd], [], [], timeout)[0])
+            elif pending:
+                # Flush pending output once per frame, or sooner if no more
+                # output arrives before the end of the frame. Flushing blocks
+                # until the terminal has caught up, which stops us from
+                # reading output faster than it can be displayed.
+                timeout = last_flush + FRAME_INTERVAL - time.monotonic()
+                if (
+                    pending_size >= FRAME_SIZE
+                    or timeout <= 0
+                    or not select.select([fd], [], [], timeout)[0]
+                ):
+                    flush()
+                    last_flush = time.monotonic()
+
+            if ready:
+                try:
+                    chunk = os.read(fd, CHUNK_SIZE)
+                except OSError:
+                    break
+                text = decoder.decode(chunk, final=not chunk)
+                window_bytes += len(chunk)
+                if flooding:
+                    # Only keep the last lines, but count all of them so we
+                    # can say how many were hidden
+                    *complete, partial = (partial + text).split("\n")
+                    hidden += len(complete)
+                    ring.extend(complete[-ring_lines:])
+                else:
+                    pending.append(text)
+                    pending_size += len(text)
+                if not chunk:
+                    # Output finished
+                    break
+
+            # Only change modes based on the rate over a whole window, so that
+            # short bursts of output are still displayed in full
+            elapsed = time.monotonic() - window_start
+            if elapsed < FLOOD_SECONDS:
+                continue
+            too_fast = window_bytes > FLOOD_RATE * elapsed
+            too_slow = window_bytes < FLOOD_RATE * elapsed
+            window_start = time.monotonic()
+            window_bytes = 0
+            if too_fast and not flooding:
+                flush()
+                if t.aborted():
+                    return
+                flooding = True
+                output_to.write(
+                    "\n[concussion: output is too fast to display, only "
+                    f"the last {ring_lines} lines will be shown until it "
+                    "slows down. Press Ctrl+C to stop]\n"
+                )
+                output_to.flush()
+            elif too_slow and flooding:
+                flooding = False
+                show_hidden()
+
+        if flooding:
+            # Show the end of the output, even if we were aborted, since
+            # nothing else has been displayed since we started flooding
+            show_hidden()
+        elif not t.aborted():
+            flush()
+
+    t = OutputThread(target=do_write, daemon=True)
+    t.start()
+
+    return t
+
+
+def _is_terminal(stream: TextIO) -> bool:
+    try:
+        return stream.isatty()
+    except (ValueError, AttributeError):
+        return False
+
+
+def stdout_write_out(buf: TextIO) -> OutputThread:
+    """
+    Write output from buffer to stdout in a separate thread, throttling it if
+    stdout is a terminal.
+    """
+    if _is_terminal(sys.stdout):
+        try:
+            buf.fileno()
+        except (io.UnsupportedOperation, AttributeError):
+            pass
+        else:
+            return terminal_write_out(buf, sys.stdout)
+    return threaded_write_out(buf, sys.stdout)
@@ -0,0 +1,374 @@
+"""
+# Concussion / plan
+
+Execution plans for commands.
+
+Preparing a command compiles it into an immutable plan, with its arguments
+stringified and its executables resolved ahead of time, so that it can be run
+many times (eg in a loop) without redoing that work.
+"""
+from dataclasses import dataclass
+from io import StringIO
+from threading import Thread
+from typing import IO, TYPE_CHECKING, Optional
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from concussion.environment import Environment, shell_env
+from concussion.output import (
+    EXIT_INTERRUPTED,
+    OUTPUT_DRAIN_TIMEOUT,
+    OutputThread,
+    stdout_write_out,
+    threaded_write_out,
+)
+
+if TYPE_CHECKING:
+    from concussion.based import ConcussionBuiltin
+
+
+@dataclass(frozen=True)
+class PlannedCommand:
+    """
+    A single command within an execution plan
+    """
+
+    argv: tuple[str, ...]
+    """
+    Arguments for the command, including the command name
+    """
+
+    executable: Optional[str] = None
+    """
+    Resolved path to the executable, or `None` if it is a builtin or wasn't
+    found
+    """
+
+    builtin: Optional['ConcussionBuiltin'] = None
+    """
+    Builtin to run, if this command is a builtin. Running a builtin doesn't
+    modify it, so the same plan can be run many times at once.
+    """
+
+    env: Optional[Environment] = None
+    """
+    Environment overrides for the command, or `None` to use the shell's
+    environment
+    """
+
+    in_file: Optional[str] = None
+    """
+    File to read input from, instead of the previous command
+    """
+
+    out_file: Optional[str] = None
+    """
+    File to write output to, instead of the next command
+    """
+
+    out_append: bool = False
+    """
+    Whether to append to the output file rather than overwriting it
+    """
+
+
+def _write_in_thread(text: str, output_to: IO[str]) -> Thread:
+    """
+    Write text to the given output in a separate thread, then close it, so
+    that we don't deadlock if the reader is slower than us.
+    """
+    def do_write():
+        try:
+            output_to.write(text)
+            output_to.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    t = Thread(target=do_write, daemon=True)
+    t.start()
+    return t
+
+
+@dataclass(frozen=True)
+class ExecutionPlan:
+    """
+    A compiled pipeline of commands, which can be run many times.
+
+    Executables are resolved when the plan is prepared, so if they are
+    installed or moved afterwards, the command should be prepared again.
+    """
+
+    commands: tuple[PlannedCommand, ...]
+    """
+    Commands in the pipeline, in the order that output flows through them
+    """
+
+    def explain(self) -> str:
+        """
+        Describe how the plan will be executed
+        """
+        out = []
+        last = len(self.commands) - 1
+        for i, cmd in enumerate(self.commands):
+            out.append(f"command {i + 1}: {' '.join(cmd.argv)}")
+            if cmd.builtin is not None:
+                out.append("  executable: (builtin)")
+            elif cmd.executable is not None:
+                out.append(f"  executable: {cmd.executable}")
+            else:
+                out.append("  executable: (not found)")
+
+            if cmd.in_file is not None:
+                out.append(f"  input: file {cmd.in_file!r}")
+            elif i == 0:
+                out.append("  input: stdin")
+            else:
+                out.append(f"  input: piped from command {i}")
+
+            if cmd.out_file is not None:
+                out.append(
+                    f"  output: file {cmd.out_file!r}"
+                    f"{' (appending)' if cmd.out_append else ''}"
+                )
+            elif i == last:
+                out.append("  output: stdout")
+            else:
+                out.append(f"  output: piped to command {i + 2}")
+
+            if cmd.env is not None:
+                overrides = ", ".join(
+                    f"{k}={v!r}" for k, v in cmd.env.overrides.items()
+                )
+                out.append(f"  environment: {overrides}")
+
+        return "\n".join(out)
+
+    def start(
+        self,
+        capture: bool = False,
+        isolate: bool = False,
+    ) -> 'Execution':
+        """
+        Start running the plan, without waiting for it to finish.
+
+        If `capture` is set, the output of the last command is made available
+        as `Execution.stdout` rather than being written to stdout.
+
+        If `isolate` is set, the commands are started in their own process
+        group, so that killing them also kills any processes they started,
+        and they don't read from stdin.
+        """
+        execution = Execution()
+        # Output of the previous command, which is either a pipe, or the text
+        # output by a builtin
+        prev_out: IO[str] | str | None = None
+        last = len(self.commands) - 1
+
+        try:
+            for i, cmd in enumerate(self.commands):
+                stdin: IO[str] | str
+                if cmd.in_file is not None:
+                    if prev_out is not None and not isinstance(prev_out, str):
+                        # Nothing will read the previous command's output
+                        prev_out.close()
+                    stdin = open(cmd.in_file, 'r')
+                    execution.files.append(stdin)
+                elif i == 0:
+                    stdin = "" if isolate else sys.stdin
+                else:
+                    assert prev_out is not None
+                    stdin = prev_out
+
+                stdout: Optional[IO[str]] = None
+                if cmd.out_file is not None:
+                    stdout = open(cmd.out_file, 'a' if cmd.out_append else 'w')
+                    execution.files.append(stdout)
+
+                if cmd.builtin is not None or cmd.executable is None:
+                    if cmd.builtin is None:
+                        out = ""
+                        err = f"{cmd.argv[0]}: command not found\n"
+                        return_code = 1
+                    else:
+                        out, err, return_code = cmd.builtin.exec_builtin(
+                            StringIO(stdin) if isinstance(stdin, str)
+                            else stdin  # type: ignore
+                        )
+                    if stdin is prev_out and not isinstance(stdin, str):
+                        stdin.close()
+                    sys.stderr.write(err)
+                    if stdout is not None:
+                        stdout.write(out)
+                        prev_out = ""
+                    else:
+                        prev_out = out
+                    if i == last:
+                        execution.last_process = None
+                        execution.return_code = return_code
+                    continue
+
+                group: dict[str, int] = {}
+                if isolate:
+                    # The first process leads the group, and the rest join it
+                    group["process_group"] = execution.process_group or 0
+                process = subprocess.Popen(
+                    cmd.argv,
+                    executable=cmd.executable,
+                    stdin=subprocess.PIPE if isinstance(stdin, str) else stdin,
+                    stdout=subprocess.PIPE if stdout is None else stdout,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    env=None if cmd.env is None else cmd.env.block(),
+                    **group,
+                )
+                execution.processes.append(process)
+                if isolate and execution.process_group is None:
+                    execution.process_group = process.pid
+                if isinstance(stdin, str):
+                    assert process.stdin is not None
+                    _write_in_thread(stdin, process.stdin)
+                elif stdin is prev_out:
+                    # The pipe now belongs to this process, so close our end
+                    # so that the previous process gets SIGPIPE if we exit
+                    stdin.close()
+
+                assert process.stderr is not None
+                execution.threads.append(
+                    threaded_write_out(process.stderr, sys.stderr)
+                )
+
+                prev_out = "" if stdout is not None else process.stdout
+                if i == last:
+                    execution.last_process = process
+        except BaseException:
+            # Don't leave half of the pipeline running
+            execution.kill()
+            execution.wait()
+            raise
+
+        # Deal with the output of the last command
+        if isinstance(prev_out, str):
+            if capture:
+                execution.stdout = StringIO(prev_out)
+            else:
+                sys.stdout.write(prev_out)
+        elif prev_out is not None:
+            if capture:
+                execution.stdout = prev_out
+            else:
+                execution.threads.append(stdout_write_out(prev_out))
+
+        return execution
+
+    def run(self) -> int:
+        """
+        Run the plan and return the exit code of the last command
+        """
+        execution = self.start()
+        try:
+            return execution.wait()
+        except KeyboardInterrupt:
+            return execution.interrupt()
+
+
+class Execution:
+    """
+    A running execution plan, created using `ExecutionPlan.start()`
+    """
+
+    def __init__(self) -> None:
+        self.processes: list[subprocess.Popen] = []
+        """
+        Processes started for the commands in the pipeline
+        """
+
+        self.threads: list[OutputThread] = []
+        """
+        Threads forwarding output from the pipeline
+        """
+
+        self.files: list[IO[str]] = []
+        """
+        Files opened for redirects, which are closed once the pipeline
+        finishes
+        """
+
+        self.stdout: Optional[IO[str]] = None
+        """
+        Output of the last command, if it was captured
+        """
+
+        self.last_process: Optional[subprocess.Popen] = None
+        """
+        Process for the last command, or `None` if it is a builtin
+        """
+
+        self.return_code = 0
+        """
+        Exit code of the last command, if it is a builtin
+        """
+
+        self.process_group: Optional[int] = None
+        """
+        Process group that the pipeline was started in, if it was isolated
+        """
+
+        self._finished = False
+
+    def kill(self) -> None:
+        """
+        Kill all of the commands in the pipeline that are still running, as
+        well as any processes they started if the pipeline is isolated
+        """
+        if self.process_group is not None:
+            try:
+                os.killpg(self.process_group, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+
+    def wait(self) -> int:
+        """
+        Wait for the pipeline to finish, and return the exit code of the last
+        command. This can safely be called more than once.
+        """
+        if not self._finished:
+            try:
+                for process in self.processes:
+                    process.wait()
+            finally:
+                for f in self.files:
+                    f.close()
+                for t in self.threads:
+                    t.stop()
+            self._finished = True
+
+            if self.last_process is not None:
+                self.return_code = self.last_process.returncode
+
+            # Make sure the output is displayed before the next prompt. Aborted
+            # threads may still have a summary of hidden output to display
+            deadline = time.monotonic() + OUTPUT_DRAIN_TIMEOUT
+            for t in self.threads:
+                t.join(max(0.0, deadline - time.monotonic()))
+
+            shell_env.status = self.return_code
+        return self.return_code
+
+    def interrupt(self) -> int:
+        """
+        Kill the pipeline straight away, throwing away any output that hasn't
+        been displayed yet, and return the exit code for being interrupted
+        """
+        self.kill()
+        for t in self.threads:
+            t.abort()
+        self.wait()
+        self.return_code = EXIT_INTERRUPTED
+        shell_env.status = self.return_code
+        return self.return_code
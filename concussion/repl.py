@@ -3,19 +3,55 @@
 
 Code for running the Python REPL that concussion is based on
 """
+import atexit
 import sys
 import code
 
-from .shell_state import shell_locals
+from .shell_state import shell_locals, shell_history
 from concussion import __version__ as version
 
+try:
+    import readline
+except ImportError:  # pragma: no cover - readline isn't available everywhere
+    readline = None  # type: ignore
+
+
+READLINE_HISTORY_LENGTH = 10_000
+"""
+Maximum number of history entries to load into readline for Ctrl+R. The full
+history can still be searched using the `history` builtin.
+"""
+
+
+class ConcussionConsole(code.InteractiveConsole):
+    """
+    Interactive console which records all input to the shell history
+    """
+
+    def raw_input(self, prompt: str = "") -> str:
+        line = super().raw_input(prompt)
+        shell_history.append(line)
+        return line
+
+
+def load_history():
+    """
+    Load the shell history into readline so that it can be searched
+    """
+    atexit.register(shell_history.close)
+    if readline is None:
+        return
+    readline.set_history_length(READLINE_HISTORY_LENGTH)
+    for entry in shell_history.tail(READLINE_HISTORY_LENGTH):
+        readline.add_history(entry)
+
 
 def main():
-    code.interact(
+    load_history()
+    ConcussionConsole(locals=shell_locals).interact(
         banner="\n".join([
             f"Concussion Shell - v{version}",
             f"Python {sys.version} on {sys.platform}"
         ]),
-        local=shell_locals,
         exitmsg="exit",
     )
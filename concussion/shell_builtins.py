@@ -5,11 +5,12 @@ Shell builtin functions
 """
 import os
 import sys
-from typing import TextIO
+from typing import Iterable, TextIO
 from concussion import ConcussionBuiltin
+from concussion.environment import Environment, shell_env
 
 
-__all__ = ['cd', 'pwd', 'exit']
+__all__ = ['cd', 'pwd', 'exit', 'history', 'shenv']
 
 
 class cd(ConcussionBuiltin):
@@ -48,3 +49,59 @@ class exit(ConcussionBuiltin):
             sys.exit()
         else:
             sys.exit(int(str(self._args[1])))
+
+
+class history(ConcussionBuiltin):
+    """
+    show command history, optionally only showing entries containing the given
+    search term
+    """
+    def run_builtin(self, stdin: TextIO) -> tuple[str, str]:
+        # Imported here, since the shell state imports these builtins
+        from .shell_state import shell_history
+
+        entries = shell_history.entries
+        if len(self._args) == 1:
+            indexes: Iterable[int] = range(len(entries))
+        else:
+            term = " ".join(str(a) for a in self._args[1:])
+            indexes = shell_history.find(term)
+
+        return "".join(f"{i + 1:>5}  {entries[i]}\n" for i in indexes), ""
+
+
+class shenv(ConcussionBuiltin):
+    """
+    print the shell's environment
+
+    Calling it with keyword arguments creates environment overrides for a
+    command, eg `shenv(FOO="bar") + printenv + FOO`, and indexing it accesses
+    the shell's environment variables, eg `shenv["FOO"] = "bar"`.
+
+    This isn't called `env` so that the system `env` command still works.
+    """
+    def __call__(self, **overrides: object) -> Environment:
+        return shell_env.overlay(**{
+            k: None if v is None else str(v)
+            for k, v in overrides.items()
+        })
+
+    @property
+    def status(self) -> int:
+        """
+        Exit code of the most recently run command
+        """
+        return shell_env.status
+
+    def __getitem__(self, key: str) -> str:
+        return shell_env[key]
+
+    def __setitem__(self, key: str, value: object) -> None:
+        shell_env[key] = str(value)
+
+    def __delitem__(self, key: str) -> None:
+        del shell_env[key]
+
+    def run_builtin(self, stdin: TextIO) -> tuple[str, str]:
+        environment = shell_env if self._env is None else self._env
+        return "".join(f"{k}={v}\n" for k, v in environment.items()), ""
@@ -8,6 +8,7 @@ allowing for programmatic modification of the REPL environment.
 from concussion import ConcussionBuiltin
 from . import shell_builtins
 from .fs_locals import FsLocals
+from .history import History
 
 
 shell_locals = FsLocals()
@@ -15,6 +16,12 @@ shell_locals = FsLocals()
 Local variables for shell
 """
 
+shell_history = History()
+"""
+Persistent command history for shell. The history file isn't read until it is
+first needed.
+"""
+
 
 def add_shell_builtins():
     """Build dict of shell builtin commands"""
@@ -0,0 +1,293 @@
+"""
+# Concussion / watch
+
+Re-run commands when files change.
+
+Changes are detected using inotify (through `ctypes`) where it's available,
+falling back to polling the files using `stat` everywhere else.
+"""
+from threading import Thread
+from typing import TYPE_CHECKING, Optional
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from concussion.environment import shell_env
+from concussion.output import EXIT_INTERRUPTED
+
+if TYPE_CHECKING:
+    from concussion.based import ConcussionBase
+    from concussion.plan import Execution
+
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+
+IN_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE
+)
+"""
+Events that count as a change to a watched file
+"""
+
+INOTIFY_EVENT = struct.Struct("iIII")
+"""
+Header of an inotify event: watch descriptor, mask, cookie and name length
+"""
+
+
+class PollingWatcher:
+    """
+    Detects changes to files by periodically calling `stat` on all of them.
+    """
+
+    def __init__(self, paths: list[str], interval: float = 0.5) -> None:
+        self.paths = paths
+        """
+        Files and directories to watch. Directories are watched recursively.
+        """
+
+        self.interval = interval
+        """
+        Number of seconds between each check for changes
+        """
+
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> dict[str, tuple[int, int, int]]:
+        snapshot = {}
+
+        def add(path: str) -> None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            snapshot[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+        for path in self.paths:
+            add(path)
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    for name in dirs + files:
+                        add(os.path.join(root, name))
+        return snapshot
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for files to change, returning whether any changed before the
+        timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                return True
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects changes to files using Linux's inotify API.
+
+    Individual files are watched through their parent directory, so that we
+    still notice changes from editors that save by replacing the file.
+    """
+
+    def __init__(self, paths: list[str]) -> None:
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._watches: dict[int, tuple[str, Optional[set[str]]]] = {}
+        """
+        Mapping of watch descriptors to the directory they watch, and the
+        names of files within that directory that we care about (or `None` if
+        all of them are relevant)
+        """
+
+        try:
+            for path in paths:
+                if os.path.isdir(path):
+                    for root, _, _ in os.walk(path):
+                        self._add_watch(root, None)
+                else:
+                    parent, name = os.path.split(os.path.abspath(path))
+                    self._add_watch(parent, name)
+        except Exception:
+            self.close()
+            raise
+
+    def _add_watch(self, directory: str, name: Optional[str]) -> None:
+        wd = self._libc.inotify_add_watch(
+            self._fd,
+            os.fsencode(directory),
+            IN_WATCH_MASK,
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        _, names = self._watches.get(wd, (directory, set()))
+        if name is None or names is None:
+            self._watches[wd] = (directory, None)
+        else:
+            self._watches[wd] = (directory, names | {name})
+
+    def _read_events(self) -> bool:
+        """
+        Read all pending events, returning whether any were relevant
+        """
+        data = os.read(self._fd, 64 * 1024)
+        changed = False
+        pos = 0
+        while pos + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b"\0"))
+            pos += length
+            if wd not in self._watches:
+                continue
+            directory, names = self._watches[wd]
+            if names is not None and name not in names:
+                continue
+            changed = True
+            # Watch new directories inside recursively watched directories
+            if names is None and mask & IN_CREATE and mask & IN_ISDIR:
+                try:
+                    self._add_watch(os.path.join(directory, name), None)
+                except OSError:
+                    pass
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for files to change, returning whether any changed before the
+        timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = (
+                None if deadline is None
+                else max(0.0, deadline - time.monotonic())
+            )
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                return False
+            if self._read_events():
+                return True
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def make_watcher(
+    paths: list[str],
+    interval: float = 0.5,
+    poll: bool = False,
+) -> InotifyWatcher | PollingWatcher:
+    """
+    Create a watcher for the given paths, using inotify if it's available,
+    and polling otherwise.
+    """
+    if not poll and hasattr(os, "O_CLOEXEC"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError, TypeError):
+            # No inotify on this platform, or too many watches
+            pass
+    return PollingWatcher(paths, interval)
+
+
+def watch(
+    command: 'ConcussionBase',
+    paths: list[str],
+    interval: float = 0.5,
+    debounce: float = 0.1,
+    poll: bool = False,
+) -> int:
+    """
+    Run the command, then run it again every time any of the given paths
+    change, until interrupted with Ctrl+C. If the files change while the
+    command is still running, it is killed (along with any processes it
+    started) and started again.
+
+    Returns the exit code of the last run of the command that finished, or
+    the exit code for being interrupted if it was still running when Ctrl+C
+    was pressed.
+    """
+    plan = command.prepare()
+    watcher = make_watcher(paths, interval, poll)
+    return_code = 0
+    run: Optional[Thread] = None
+    execution: Optional['Execution'] = None
+    cancelled = False
+
+    def do_run():
+        nonlocal return_code, execution
+        execution = plan.start(isolate=True)
+        code = execution.wait()
+        # Runs that we killed don't count as finishing
+        if not cancelled:
+            return_code = code
+
+    def cancel() -> bool:
+        """
+        Kill the current run, returning whether it was still running
+        """
+        nonlocal cancelled
+        cancelled = True
+        running = run is not None and run.is_alive()
+        # Keep trying, in case the command's processes haven't started yet
+        while run is not None and run.is_alive():
+            if execution is not None:
+                execution.kill()
+            run.join(0.05)
+        return running
+
+    try:
+        while True:
+            # Make sure we can't kill the previous run's processes (whose
+            # process group could have been reused) by mistake
+            execution = None
+            cancelled = False
+            run = Thread(target=do_run, daemon=True)
+            run.start()
+            watcher.wait()
+            # Wait for a burst of changes (eg from a `git checkout`) to settle
+            # before running the command again
+            while watcher.wait(debounce):
+                pass
+            cancel()
+    except KeyboardInterrupt:
+        if cancel():
+            return_code = EXIT_INTERRUPTED
+    finally:
+        watcher.close()
+
+    shell_env.status = return_code
+    return return_code
@@ -0,0 +1,89 @@
+"""
+# Tests / adapters test
+
+Tests for parsing structured command output
+"""
+import signal
+from typing import TextIO
+
+import pytest
+
+from concussion import ConcussionBuiltin, ConcussionExecutable
+from concussion.environment import shell_env
+from concussion.adapters import parse_columns, parse_csv, parse_jsonl
+
+
+class output(ConcussionBuiltin):
+    """
+    Builtin that outputs its arguments, one per line
+    """
+    def run_builtin(self, stdin: TextIO) -> tuple[str, str]:
+        return "".join(f"{a}\n" for a in self._args[1:]), ""
+
+
+def test_jsonl():
+    lines = ['{"a": 1, "b": 2}\n', '\n', '{"a": 3}\n']
+    assert list(parse_jsonl(lines)) == [{"a": 1, "b": 2}, {"a": 3}]
+
+
+def test_jsonl_fields():
+    lines = ['{"a": 1, "b": 2}\n', '{"b": 3}\n']
+    assert list(parse_jsonl(lines, ["a"])) == [{"a": 1}, {"a": None}]
+
+
+def test_jsonl_fields_not_object():
+    with pytest.raises(TypeError):
+        list(parse_jsonl(['{"a": 1}\n', '[1, 2]\n'], ["a"]))
+
+
+def test_csv():
+    lines = ['name,age\n', 'Maddy,22\n', '"Smith, J",40\n']
+    assert list(parse_csv(lines)) == [
+        {"name": "Maddy", "age": "22"},
+        {"name": "Smith, J", "age": "40"},
+    ]
+
+
+def test_csv_fields():
+    lines = ['name,age\n', 'Maddy,22\n']
+    assert list(parse_csv(lines, ["age"])) == [{"age": "22"}]
+    assert list(parse_csv(lines, [1], header=False)) == [["age"], ["22"]]
+    assert list(parse_csv(lines, [5], header=False)) == [[None], [None]]
+
+
+def test_columns():
+    lines = [
+        "  PID TTY          TIME CMD\n",
+        "    1 ?        00:00:01 python -m concussion\n",
+    ]
+    assert list(parse_columns(lines, ["PID", "CMD"])) == [
+        {"PID": "1", "CMD": "python -m concussion"},
+    ]
+
+
+def test_columns_no_header():
+    lines = [
+        "total 4\n",
+        "-rw-r--r-- 1 maddy maddy 1069 Jan 1 00:00 LICENSE\n",
+        "\n",
+    ]
+    assert list(parse_columns(lines, [0, 8], header=False)) == [
+        ["total", None],
+        ["-rw-r--r--", "LICENSE"],
+    ]
+
+
+def test_command_iter_lines():
+    assert list((output() + "a" + "b").iter_lines()) == ["a", "b"]
+
+
+def test_command_iter_jsonl():
+    cmd = output() + '{"a": 1}' + '{"a": 2}'
+    assert [r["a"] for r in cmd.iter_jsonl()] == [1, 2]
+
+
+def test_command_killed_when_closed_early():
+    lines = (ConcussionExecutable("yes") < "/dev/null").iter_lines()
+    assert next(lines) == "y"
+    lines.close()
+    assert shell_env.status == -signal.SIGKILL
@@ -0,0 +1,121 @@
+"""
+# Tests / environment test
+
+Tests for environment overlays
+"""
+import os
+from typing import TextIO
+
+import pytest
+
+from concussion import ConcussionBuiltin, ConcussionExecutable
+from concussion.environment import Environment, shell_env
+from concussion.shell_builtins import shenv
+from concussion.shell_state import shell_locals
+
+
+class printenv(ConcussionBuiltin):
+    """
+    Builtin that prints a variable from its environment
+    """
+    def run_builtin(self, stdin: TextIO) -> tuple[str, str]:
+        environment = shell_env if self._env is None else self._env
+        return environment[str(self._args[1])] + "\n", ""
+
+
+@pytest.fixture
+def root(monkeypatch):
+    monkeypatch.setenv("CONCUSSION_TEST", "base")
+    return Environment()
+
+
+def test_root_inherits(root):
+    assert root.block() is None
+    assert root["CONCUSSION_TEST"] == "base"
+
+
+def test_overlay(root):
+    overlay = root.overlay(CONCUSSION_TEST="overlay", OTHER="hi")
+    assert overlay["CONCUSSION_TEST"] == "overlay"
+    assert overlay.block()["OTHER"] == "hi"
+    assert root["CONCUSSION_TEST"] == "base"
+    assert "OTHER" not in os.environ
+
+
+def test_overlay_remove(root):
+    overlay = root.overlay(CONCUSSION_TEST=None)
+    assert "CONCUSSION_TEST" not in overlay
+    assert "CONCUSSION_TEST" not in overlay.block()
+
+
+def test_block_cached(root):
+    overlay = root.overlay(OTHER="hi")
+    block = overlay.block()
+    assert overlay.block() is block
+
+
+def test_block_rebuilt_when_parent_changes(root):
+    overlay = root.overlay(OTHER="hi")
+    block = overlay.block()
+    root["CONCUSSION_TEST"] = "changed"
+    assert overlay.block() is not block
+    assert overlay.block()["CONCUSSION_TEST"] == "changed"
+
+
+def test_block_rebuilt_when_os_environ_changes(root, monkeypatch):
+    overlay = root.overlay(OTHER="hi")
+    overlay.block()
+    monkeypatch.setenv("CONCUSSION_TEST", "changed")
+    assert overlay.block()["CONCUSSION_TEST"] == "changed"
+    monkeypatch.delenv("CONCUSSION_TEST")
+    assert "CONCUSSION_TEST" not in overlay.block()
+
+
+def test_nested_overrides(root):
+    outer = root.overlay(A="outer", B="outer")
+    inner = Environment(outer, {"B": "inner"})
+    assert inner.overrides == {"A": "outer", "B": "inner"}
+
+
+def test_command_env():
+    overlay = shell_env.overlay(CONCUSSION_TEST="hi")
+    cmd = overlay + (printenv() + "CONCUSSION_TEST")
+    assert list(cmd.iter_lines()) == ["hi"]
+
+
+def test_command_env_inner_takes_priority():
+    cmd = shell_env.overlay(CONCUSSION_TEST="outer") + (
+        shell_env.overlay(CONCUSSION_TEST="inner")
+        + (printenv() + "CONCUSSION_TEST")
+    )
+    assert list(cmd.iter_lines()) == ["inner"]
+
+
+def test_status():
+    cmd = printenv() + "CONCUSSION_DEFINITELY_NOT_SET"
+    assert cmd.run() == 1
+    assert shell_env.status == 1
+
+
+def test_shenv_overrides():
+    cmd = shenv()(CONCUSSION_TEST="hi", OTHER=None) + shenv()
+    assert "CONCUSSION_TEST=hi" in list(cmd.iter_lines())
+
+
+def test_shenv_variables(monkeypatch):
+    monkeypatch.delenv("CONCUSSION_TEST", raising=False)
+    shenv()["CONCUSSION_TEST"] = 42
+    assert os.environ["CONCUSSION_TEST"] == "42"
+    assert shenv()["CONCUSSION_TEST"] == "42"
+    del shenv()["CONCUSSION_TEST"]
+    assert "CONCUSSION_TEST" not in os.environ
+
+
+def test_shenv_status():
+    (printenv() + "CONCUSSION_DEFINITELY_NOT_SET").run()
+    assert shenv().status == 1
+
+
+def test_system_env_not_shadowed():
+    assert "env" not in shell_locals
+    assert isinstance(shell_locals["env"], ConcussionExecutable)
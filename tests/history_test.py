@@ -0,0 +1,129 @@
+"""
+# Tests / history test
+
+Tests for the persistent command history
+"""
+import zlib
+
+from concussion import shell_state
+from concussion.history import History, RECORD_HEADER, RECORD_MAGIC
+from concussion.shell_builtins import history as history_builtin
+
+
+def test_history_persists(tmp_path):
+    path = str(tmp_path / "history")
+    history = History(path)
+    history.append("echo + hi")
+    history.append("ls + -l")
+    history.close()
+
+    assert History(path).entries == ["echo + hi", "ls + -l"]
+
+
+def test_blank_lines_ignored(tmp_path):
+    history = History(str(tmp_path / "history"))
+    history.append("")
+    history.append("   ")
+    assert history.entries == []
+
+
+def test_concurrent_sessions(tmp_path):
+    path = str(tmp_path / "history")
+    a = History(path)
+    b = History(path)
+    a.append("from a")
+    b.append("from b")
+    a.append("from a again")
+
+    assert a.entries == ["from a", "from b", "from a again"]
+    b.reload()
+    assert b.entries == ["from a", "from b", "from a again"]
+
+
+def test_corrupt_records_skipped(tmp_path):
+    path = tmp_path / "history"
+    history = History(str(path))
+    history.append("before")
+    history.close()
+    with open(path, "ab") as f:
+        f.write(b"\xc0\x5e\xff\xff")
+    history = History(str(path))
+    history.append("after")
+
+    assert History(str(path)).entries == ["before", "after"]
+
+
+def test_torn_record_skipped(tmp_path):
+    path = tmp_path / "history"
+    history = History(str(path))
+    history.append("first")
+    history.close()
+    # A session crashed part way through writing a record
+    payload = b"a command that was never finished"
+    with open(path, "ab") as f:
+        f.write(RECORD_HEADER.pack(
+            RECORD_MAGIC,
+            len(payload),
+            zlib.crc32(payload),
+        ))
+        f.write(payload[:12])
+    history = History(str(path))
+    for entry in ["second", "third", "fourth"]:
+        history.append(entry)
+
+    expected = ["first", "second", "third", "fourth"]
+    assert history.entries == expected
+    assert History(str(path)).entries == expected
+
+
+def test_tail(tmp_path):
+    path = tmp_path / "history"
+    history = History(str(path))
+    for entry in ["one", "two", "three"]:
+        history.append(entry)
+    history.close()
+    with open(path, "ab") as f:
+        f.write(RECORD_HEADER.pack(RECORD_MAGIC, 100, 0) + b"torn")
+
+    history = History(str(path))
+    assert history.tail(2) == ["two", "three"]
+    assert history.tail(10) == ["one", "two", "three"]
+    # The full history isn't loaded until it's needed
+    assert history._entries is None
+    history.append("four")
+    assert history._entries is None
+    assert history.entries == ["one", "two", "three", "four"]
+    assert history.tail(2) == ["three", "four"]
+
+
+def test_find(tmp_path):
+    history = History(str(tmp_path / "history"))
+    for entry in ["cat + a.txt", "ls", "head + a.txt", "cat + a.txt"]:
+        history.append(entry)
+
+    assert history.find("a.txt") == [0, 2, 3]
+    assert history.find("") == [0, 1, 2, 3]
+    assert history.find("zzz") == []
+
+
+def test_history_builtin(tmp_path, monkeypatch):
+    history = History(str(tmp_path / "history"))
+    for entry in ["cat + a.txt", "ls", "head + a.txt"]:
+        history.append(entry)
+    monkeypatch.setattr(shell_state, "shell_history", history)
+
+    assert list((history_builtin() + "a.txt").iter_lines()) == [
+        "    1  cat + a.txt",
+        "    3  head + a.txt",
+    ]
+
+
+def test_search_substring(tmp_path):
+    history = History(str(tmp_path / "history"))
+    for entry in ["cat + a.txt", "ls", "head + a.txt", "cat + a.txt"]:
+        history.append(entry)
+
+    assert history.search("a.txt") == ["cat + a.txt", "head + a.txt"]
+    assert history.search("a.txt", limit=1) == ["cat + a.txt"]
+    assert history.search("s") == ["ls"]
+    assert history.search("zzz") == []
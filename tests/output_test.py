@@ -0,0 +1,131 @@
+"""
+# Tests / output test
+
+Tests for forwarding command output to the terminal
+"""
+import os
+import time
+from io import StringIO
+from threading import Thread
+
+from concussion import output
+from concussion.output import terminal_write_out
+
+
+def make_pipe(data: str):
+    """
+    Create a pipe that outputs the given data and then closes
+    """
+    r, w = os.pipe()
+
+    def do_write():
+        with os.fdopen(w, "w") as f:
+            f.write(data)
+
+    Thread(target=do_write, daemon=True).start()
+    return os.fdopen(r, "r")
+
+
+def wait_for_output(out: StringIO, text: str):
+    deadline = time.monotonic() + 5
+    while text not in out.getvalue():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_terminal_output():
+    out = StringIO()
+    terminal_write_out(make_pipe("hello\nworld\n"), out).join(5)
+    assert out.getvalue() == "hello\nworld\n"
+
+
+def test_terminal_output_unicode():
+    out = StringIO()
+    data = "🧠" * 100_000
+    terminal_write_out(make_pipe(data), out).join(5)
+    assert out.getvalue() == data
+
+
+def test_terminal_output_flood(monkeypatch):
+    monkeypatch.setattr(output, "FLOOD_RATE", 0)
+    monkeypatch.setattr(output, "FLOOD_SECONDS", 0.0)
+    lines = [f"line {i}" for i in range(100_000)]
+    out = StringIO()
+    t = terminal_write_out(make_pipe("\n".join(lines) + "\n"), out, 10)
+    t.join(5)
+
+    shown, notice, rest = out.getvalue().partition(
+        "\n[concussion: output is too fast"
+    )
+    assert notice
+    marker, tail = rest.split("\n", 1)[1].split("\n", 1)
+    hidden = int(
+        marker.removeprefix("[concussion: ").removesuffix(" lines hidden]")
+    )
+    assert tail == "".join(f"{line}\n" for line in lines[-10:])
+    assert hidden == len(lines) - shown.count("\n") - 10
+
+
+def test_terminal_output_burst_shown(monkeypatch):
+    # A burst of more output than the window allows for is still shown in
+    # full if it finishes before the end of the window
+    monkeypatch.setattr(output, "FLOOD_RATE", 1000)
+    monkeypatch.setattr(output, "FLOOD_SECONDS", 60.0)
+    data = "".join(f"line {i}\n" for i in range(100_000))
+    out = StringIO()
+    terminal_write_out(make_pipe(data), out, 10).join(5)
+    assert out.getvalue() == data
+
+
+def test_terminal_output_flood_ends(monkeypatch):
+    monkeypatch.setattr(output, "FLOOD_RATE", 1)
+    monkeypatch.setattr(output, "FLOOD_SECONDS", 0.2)
+    r, w = os.pipe()
+    out = StringIO()
+    with os.fdopen(r, "r") as buf:
+        t = terminal_write_out(buf, out, 2)
+        os.write(w, b"a\n")
+        time.sleep(0.3)
+        os.write(w, b"b\n")
+        wait_for_output(out, "too fast")
+        os.write(w, b"c\nd\ne\n")
+        # Once the output slows down, the lines we kept are shown, and
+        # output is displayed normally again
+        wait_for_output(out, "lines hidden")
+        os.write(w, b"done\n")
+        os.close(w)
+        t.join(5)
+    assert out.getvalue().endswith(
+        "[concussion: 1 lines hidden]\nd\ne\ndone\n"
+    )
+
+
+def test_terminal_output_abort():
+    r, w = os.pipe()
+    out = StringIO()
+    with os.fdopen(r, "r") as buf:
+        t = terminal_write_out(buf, out)
+        t.abort()
+        os.write(w, b"hello\n")
+        os.close(w)
+        t.join(5)
+    assert not t.is_alive()
+    assert out.getvalue() == ""
+
+
+def test_terminal_output_abort_while_flooding(monkeypatch):
+    monkeypatch.setattr(output, "FLOOD_RATE", 0)
+    monkeypatch.setattr(output, "FLOOD_SECONDS", 0.0)
+    r, w = os.pipe()
+    out = StringIO()
+    with os.fdopen(r, "r") as buf:
+        t = terminal_write_out(buf, out, 2)
+        os.write(w, b"a\nb\n")
+        wait_for_output(out, "too fast")
+        os.write(w, b"c\nd\ne\n")
+        t.abort()
+        os.close(w)
+        t.join(5)
+    assert not t.is_alive()
+    # The end of the output is still shown
+    assert out.getvalue().endswith("[concussion: 1 lines hidden]\nd\ne\n")
@@ -0,0 +1,108 @@
+"""
+# Tests / plan test
+
+Tests for preparing commands into execution plans
+"""
+from typing import TextIO
+
+from concussion import ConcussionBuiltin, ConcussionExecutable
+from concussion.environment import shell_env
+from concussion.shell_builtins import pwd
+
+
+class fail(ConcussionBuiltin):
+    """
+    Builtin that always fails
+    """
+    def run_builtin(self, stdin: TextIO) -> tuple[str, str]:
+        raise ValueError("it broke")
+
+
+def test_prepare_stringifies_args():
+    plan = (ConcussionExecutable("echo") + "hello" + 42).prepare()
+    assert plan.commands[0].argv == ("echo", "hello", "42")
+
+
+def test_prepare_resolves_executable():
+    plan = ConcussionExecutable("sh").prepare()
+    assert plan.commands[0].executable is not None
+    assert plan.commands[0].executable.endswith("/sh")
+
+
+def test_prepare_missing_executable():
+    plan = ConcussionExecutable("concussion-does-not-exist").prepare()
+    assert plan.commands[0].executable is None
+
+
+def test_prepare_pipeline_order():
+    cmd = ConcussionExecutable("cat") | "sort" | "uniq"
+    plan = cmd.prepare()
+    assert [c.argv[0] for c in plan.commands] == ["cat", "sort", "uniq"]
+
+
+def test_explain():
+    cmd = (ConcussionExecutable("cat") < "in.txt") | "sort"
+    cmd = cmd >> "out.txt"
+    assert cmd.prepare().explain().splitlines()[2:] == [
+        "  input: file 'in.txt'",
+        "  output: piped to command 2",
+        "command 2: sort",
+        "  executable: " + str(cmd.prepare().commands[1].executable),
+        "  input: piped from command 1",
+        "  output: file 'out.txt' (appending)",
+    ]
+
+
+def test_run_pipeline(tmp_path):
+    (tmp_path / "in.txt").write_text("b\na\nb\n")
+    cmd = (ConcussionExecutable("cat") < str(tmp_path / "in.txt")) | "sort"
+    cmd = (cmd | ConcussionExecutable("uniq")) > str(tmp_path / "out.txt")
+    plan = cmd.prepare()
+
+    assert plan.run() == 0
+    assert (tmp_path / "out.txt").read_text() == "a\nb\n"
+    # Plans can be run again
+    (tmp_path / "in.txt").write_text("c\n")
+    assert plan.run() == 0
+    assert (tmp_path / "out.txt").read_text() == "c\n"
+
+
+def test_run_builtin_into_process(tmp_path):
+    cmd = pwd() | (ConcussionExecutable("wc") + "-l")
+    plan = (cmd > str(tmp_path / "out.txt")).prepare()
+
+    assert plan.run() == 0
+    assert (tmp_path / "out.txt").read_text().strip() == "1"
+
+
+def test_run_env(tmp_path):
+    cmd = ConcussionExecutable("sh") + "-c" + "echo $CONCUSSION_TEST"
+    cmd = shell_env.overlay(CONCUSSION_TEST="hi") + (cmd < "/dev/null")
+    plan = (cmd > str(tmp_path / "out.txt")).prepare()
+
+    assert plan.run() == 0
+    assert (tmp_path / "out.txt").read_text() == "hi\n"
+
+
+def test_run_status(tmp_path):
+    cmd = (ConcussionExecutable("sh") + "-c" + "exit 3") < "/dev/null"
+    assert cmd.prepare().run() == 3
+    assert shell_env.status == 3
+
+
+def test_start_capture():
+    cmd = (ConcussionExecutable("sh") + "-c" + "echo hi; exit 2") < "/dev/null"
+    execution = cmd.prepare().start(capture=True)
+    assert execution.stdout is not None
+    assert execution.stdout.read() == "hi\n"
+    assert execution.wait() == 2
+    assert execution.wait() == 2
+
+
+def test_run_builtin_error(capsys):
+    plan = fail().prepare()
+    assert plan.run() == 1
+    assert capsys.readouterr().err == "it broke\n"
+    assert shell_env.status == 1
+    # Builtins don't keep any state between runs
+    assert vars(plan.commands[0].builtin) == vars(fail())
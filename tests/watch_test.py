@@ -0,0 +1,149 @@
+"""
+# Tests / watch test
+
+Tests for detecting changes to watched files
+"""
+from threading import Thread
+import os
+import signal
+import time
+
+import pytest
+
+from concussion import ConcussionExecutable
+from concussion.environment import shell_env
+from concussion.output import EXIT_INTERRUPTED
+from concussion.watch import InotifyWatcher, PollingWatcher
+
+
+def make_inotify(paths):
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError, TypeError):
+        pytest.skip("inotify not available")
+
+
+def make_polling(paths):
+    return PollingWatcher(paths, interval=0.01)
+
+
+@pytest.fixture(params=[make_inotify, make_polling])
+def make_watcher(request):
+    return request.param
+
+
+def test_no_changes(tmp_path, make_watcher):
+    (tmp_path / "file.txt").write_text("hi")
+    watcher = make_watcher([str(tmp_path / "file.txt")])
+    assert not watcher.wait(0.05)
+    watcher.close()
+
+
+def test_file_modified(tmp_path, make_watcher):
+    file = tmp_path / "file.txt"
+    file.write_text("hi")
+    watcher = make_watcher([str(file)])
+    file.write_text("hello")
+    assert watcher.wait(1)
+    watcher.close()
+
+
+def test_other_file_ignored(tmp_path, make_watcher):
+    file = tmp_path / "file.txt"
+    file.write_text("hi")
+    watcher = make_watcher([str(file)])
+    (tmp_path / "other.txt").write_text("hello")
+    assert not watcher.wait(0.05)
+    watcher.close()
+
+
+def test_directory_watched_recursively(tmp_path, make_watcher):
+    (tmp_path / "sub").mkdir()
+    watcher = make_watcher([str(tmp_path)])
+    (tmp_path / "sub" / "new.txt").write_text("hello")
+    assert watcher.wait(1)
+    watcher.close()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def interrupt_after(steps):
+    """
+    Run the given steps in a thread, then press Ctrl+C to stop watching.
+    Returns a list which any error from the steps is added to.
+    """
+    errors = []
+
+    def do_steps():
+        try:
+            steps()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            os.kill(os.getpid(), signal.SIGINT)
+
+    Thread(target=do_steps, daemon=True).start()
+    return errors
+
+
+def is_running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Killed processes may be left as zombies if nothing reaps them
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_watch_reruns_after_change(tmp_path):
+    (tmp_path / "src").mkdir()
+    log = tmp_path / "log"
+    cmd = ConcussionExecutable("sh") + "-c" + f"echo run >> {log}"
+
+    def runs():
+        return log.read_text().count("run") if log.exists() else 0
+
+    def steps():
+        wait_for(lambda: runs() == 1)
+        # A burst of changes only runs the command once
+        for i in range(5):
+            (tmp_path / "src" / "file.txt").write_text(str(i))
+        wait_for(lambda: runs() == 2)
+        time.sleep(0.3)
+
+    errors = interrupt_after(steps)
+    assert cmd.watch(str(tmp_path / "src"), debounce=0.1) == 0
+    assert errors == []
+    assert runs() == 2
+
+
+def test_watch_kills_running_command(tmp_path):
+    (tmp_path / "src").mkdir()
+    pid_file = tmp_path / "pid"
+    cmd = ConcussionExecutable("sh") + "-c"
+    cmd += f"sleep 30 & echo $! > {pid_file}; wait"
+    pids = []
+
+    def read_pid():
+        text = pid_file.read_text() if pid_file.exists() else ""
+        if text.endswith("\n") and int(text) not in pids:
+            pids.append(int(text))
+        return len(pids)
+
+    def steps():
+        wait_for(lambda: read_pid() == 1)
+        (tmp_path / "src" / "file.txt").write_text("hi")
+        wait_for(lambda: read_pid() == 2)
+
+    errors = interrupt_after(steps)
+    # The last run was still going when we pressed Ctrl+C
+    assert cmd.watch(str(tmp_path / "src"), debounce=0.1) == EXIT_INTERRUPTED
+    assert shell_env.status == EXIT_INTERRUPTED
+    assert errors == []
+    # Processes started by the command are killed too
+    wait_for(lambda: not any(is_running(pid) for pid in pids), 1.0)